@@ -1,43 +1,106 @@
 import struct
 import os
-import tempfile
+import mmap
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import Optional
+from typing import Optional, Union
+import av
 import cv2
 import numpy as np
 from PIL import Image
 
+# magic number of .milimg files, payloads are raw AV1 bitstreams (low overhead OBU format)
+MAGIC = b"Milimg00"
+
+# fixed-size file header: magic, version, width, height, color payload size
+_HEADER = struct.Struct(">8sIIIQ")
+# size of the alpha payload, follows the color payload in version 1 files
+_ALPHA_SIZE = struct.Struct(">Q")
+
+# AV1 decoders in order of preference, dav1d is the fastest software decoder
+AV1_DECODERS = ("libdav1d", "libaom-av1")
+
+# output formats written directly by OpenCV in the command line tool, all of them keep alpha.
+# formats without alpha (jpg) stay on the Pillow path, which refuses to drop transparency silently
+OPENCV_OUTPUT_EXTS = {".png", ".webp"}
+OPENCV_WRITE_PARAMS = {".png": [cv2.IMWRITE_PNG_COMPRESSION, 1]}
+
+
+Payload = Union[bytes, memoryview]
+
 
 @dataclass
 class MilimgHeader:
-    """storage data in .milimg file (this part is unchanged)"""
+    """
+    storage data in .milimg file.
+    payloads are bytes or memoryview slices of the memory mapped file (see parse_milimg_container).
+    """
 
     version: int
     width: int
     height: int
-    color_payload: bytes
-    alpha_payload: Optional[bytes] = None
+    color_payload: Payload
+    alpha_payload: Optional[Payload] = None
+
+
+def _advise_sequential(fd: int, mm: mmap.mmap) -> None:
+    """
+    hint the kernel that the whole file is read once front to back, so it reads ahead aggressively.
+    hints are best effort, they are skipped where the platform doesn't support them.
+    """
+    try:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        if hasattr(mmap, "MADV_SEQUENTIAL"):
+            mm.madvise(mmap.MADV_SEQUENTIAL)
+        if hasattr(mmap, "MADV_WILLNEED"):
+            mm.madvise(mmap.MADV_WILLNEED)
+    except OSError:
+        pass
 
 
 def parse_milimg_container(file_path: str) -> MilimgHeader:
     """
-    parse .milimg container file, extract metadata and compressed data blocks.(this function is unchanged)
+    parse .milimg container file, extract metadata and compressed data blocks.
+    the file is memory mapped, payloads are memoryview slices of the mapping (no copy).
+    the mapping is not closed explicitly: it is released by garbage collection once the
+    returned header and every payload view derived from it are gone.
     """
     with open(file_path, "rb") as f:
-        if f.read(8) != b"Milimg00":
-            raise ValueError("file format error: invalid magic number")
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty file can't be mapped
+            raise ValueError("file format error: invalid magic number") from None
+        _advise_sequential(f.fileno(), mm)
+    # the mapping stays alive as long as any payload view references it
+    data = memoryview(mm)
+
+    if len(data) < _HEADER.size:
+        raise ValueError("file format error: truncated header")
 
-        version = struct.unpack(">I", f.read(4))[0]
-        if version not in [0, 1]:
-            raise ValueError(f"unsupported version: {version}")
+    magic, version, width, height, color_payload_size = _HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("file format error: invalid magic number")
+    if version not in [0, 1]:
+        raise ValueError(f"unsupported version: {version}")
 
-        width, height, color_payload_size = struct.unpack(">IIQ", f.read(16))
-        color_payload = f.read(color_payload_size)
+    offset = _HEADER.size
+    if offset + color_payload_size > len(data):
+        raise ValueError("file format error: truncated color data")
+    color_payload = data[offset : offset + color_payload_size]
+    offset += color_payload_size
 
-        alpha_payload = None
-        if version == 1:
-            alpha_payload_size = struct.unpack(">Q", f.read(8))[0]
-            alpha_payload = f.read(alpha_payload_size)
+    alpha_payload = None
+    if version == 1:
+        if offset + _ALPHA_SIZE.size > len(data):
+            raise ValueError("file format error: truncated alpha size")
+        (alpha_payload_size,) = _ALPHA_SIZE.unpack_from(data, offset)
+        offset += _ALPHA_SIZE.size
+        if offset + alpha_payload_size > len(data):
+            raise ValueError("file format error: truncated alpha data")
+        alpha_payload = data[offset : offset + alpha_payload_size]
 
     return MilimgHeader(
         version=version,
@@ -48,71 +111,114 @@ def parse_milimg_container(file_path: str) -> MilimgHeader:
     )
 
 
-def decode_av1_frame_with_opencv(payload: bytes) -> Optional[np.ndarray]:
+def _create_av1_decoder() -> av.codec.CodecContext:
+    """create a decoder context with the fastest available AV1 decoder."""
+    for name in AV1_DECODERS:
+        try:
+            return av.codec.CodecContext.create(name, "r")
+        except av.codec.codec.UnknownCodecError:
+            continue
+    raise ValueError(f"no AV1 decoder available, tried: {', '.join(AV1_DECODERS)}")
+
+
+def _luma_plane(frame: av.VideoFrame) -> np.ndarray:
     """
-    decode single AV1 frame data with OpenCV (cv2.VideoCapture).
-    write temporary file, because VideoCapture can't read memory stream directly.
+    return the luma plane of a decoded frame as is.
+    alpha is stored as gray or as luma of YUV420 with neutral chroma, converting through
+    libswscale would remap it as limited range, so the plane is read directly.
+    """
+    if frame.format.components[0].bits != 8:
+        return frame.to_ndarray(format="gray8")
+    plane = frame.planes[0]
+    luma = np.frombuffer(plane, dtype=np.uint8).reshape(plane.height, plane.line_size)
+    return luma[:, : frame.width]
+
+
+def decode_av1_frame(payload: Payload, alpha: bool = False) -> Optional[np.ndarray]:
+    """
+    decode single AV1 frame data (raw AV1 bitstream) in memory with a PyAV codec context.
+    frame is returned as RGB, or as its luma plane (H, W) if alpha is True.
     """
     if not payload:
         return None
 
-    # create a temporary file to store AV1 data
-    # delete=False allows us to access the file name after closing the file
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".ivf") as tmp:
-        tmp.write(payload)
-        temp_filename = tmp.name
-
-    frame = None
-    cap = None
     try:
-        cap = cv2.VideoCapture(temp_filename)
-        if not cap.isOpened():
-            raise IOError(f"OpenCV can't open temporary file: {temp_filename}")
+        # feed AV1 data straight to the decoder, no demuxer, format probing or file IO involved
+        ctx = _create_av1_decoder()
+        packets = ctx.parse(payload)
 
-        ret, frame = cap.read()
-        if not ret:
-            raise ValueError("OpenCV can't read frame")
+        frames = []
+        for packet in packets:
+            frames.extend(ctx.decode(packet))
+        # flush the decoder, it may hold the frame back
+        frames.extend(ctx.decode(None))
+        if not frames:
+            print("PyAV decode failed: no frame in payload")
+            return None
 
+        frame = frames[0]
+        if alpha:
+            return _luma_plane(frame)
+        # let libswscale convert straight to RGB, no extra BGR->RGB pass needed
+        return frame.to_ndarray(format="rgb24")
     except Exception as e:
-        print(f"OpenCV decode failed: {e}")
+        print(f"PyAV decode failed: {e}")
         return None
-    finally:
-        if cap:
-            cap.release()
-        os.remove(temp_filename)
-    return frame
 
 
-def decode_milimg(file_path: str) -> Optional[Image.Image]:
+def decode_milimg(file_path: str, return_numpy: bool = False) -> Optional[Union[Image.Image, np.ndarray]]:
     """
-    decode .milimg file with OpenCV
+    decode .milimg file with PyAV
+    if return_numpy is True, return RGBA data as numpy array (H, W, 4) instead of Pillow image.
     """
     header = parse_milimg_container(file_path)
 
-    print("decoding color data with OpenCV...")
-    color_frame_bgr = decode_av1_frame_with_opencv(header.color_payload)
-    if color_frame_bgr is None:
+    has_alpha = header.version == 1 and bool(header.alpha_payload)
+    alpha_channel_np = None
+    if has_alpha:
+        # decode color and alpha data concurrently, the AV1 decoder releases the GIL
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            print("decoding color data with PyAV...")
+            color_future = pool.submit(decode_av1_frame, header.color_payload)
+            print("decoding alpha data with PyAV...")
+            alpha_future = pool.submit(decode_av1_frame, header.alpha_payload, alpha=True)
+
+            color_frame_rgb = color_future.result()
+            alpha_channel_np = alpha_future.result()
+    else:
+        # only one payload, no pool needed
+        print("decoding color data with PyAV...")
+        color_frame_rgb = decode_av1_frame(header.color_payload)
+
+    if color_frame_rgb is None:
         print("decoding color data failed.")
         return None
 
-    color_frame_rgb = cv2.cvtColor(color_frame_bgr, cv2.COLOR_BGR2RGB)
-    rgb_image = Image.fromarray(color_frame_rgb)
+    if has_alpha and alpha_channel_np is None:
+        print("Alpha data decode failed, will return only color image.")
 
-    if header.version == 1 and header.alpha_payload:
-        print("decoding alpha data with OpenCV...")
-        alpha_frame_bgr = decode_av1_frame_with_opencv(header.alpha_payload)
+    # write color and alpha planes straight into one RGBA buffer, no Pillow intermediates.
+    # the alpha plane is the decoder's native 8-bit luma, copied once with no channel select
+    # or gray->RGB round trip, opaque images fill the alpha channel in place
+    height, width = color_frame_rgb.shape[:2]
+    rgba = np.empty((height, width, 4), dtype=np.uint8)
+    rgba[:, :, :3] = color_frame_rgb
+    rgba[:, :, 3] = 255 if alpha_channel_np is None else alpha_channel_np
 
-        if alpha_frame_bgr is not None:
-            alpha_channel_np = alpha_frame_bgr[:, :, 0]
-            alpha_image = Image.fromarray(alpha_channel_np, mode="L")
+    if return_numpy:
+        return rgba
+    # (H, W, 4) uint8 array is picked up as RGBA by Pillow
+    return Image.fromarray(rgba)
 
-            rgba_image = rgb_image.convert("RGBA")
-            rgba_image.putalpha(alpha_image)
-            return rgba_image
-        else:
-            print("Alpha data decode failed, will return only color image.")
 
-    return rgb_image.convert("RGBA")
+def save_rgba_with_opencv(rgba: np.ndarray, output_path: str) -> bool:
+    """
+    save RGBA numpy array with OpenCV (cv2.imwrite), skipping Pillow.
+    PNG uses zlib level 1: about 2x faster to write than the default level, files about 45% larger.
+    """
+    ext = os.path.splitext(output_path)[1].lower()
+    bgra = cv2.cvtColor(rgba, cv2.COLOR_RGBA2BGRA)
+    return cv2.imwrite(output_path, bgra, OPENCV_WRITE_PARAMS.get(ext, []))
 
 
 if __name__ == "__main__":
@@ -140,11 +246,20 @@ if __name__ == "__main__":
 
     try:
         print(f"start processing file: {args.input}")
-        final_image = decode_milimg(args.input)
+        if os.path.splitext(args.output)[1].lower() in OPENCV_OUTPUT_EXTS:
+            rgba = decode_milimg(args.input, return_numpy=True)
+
+            if rgba is not None:
+                if save_rgba_with_opencv(rgba, args.output):
+                    print(f"decode success! image saved as '{args.output}'")
+                else:
+                    print(f"error: OpenCV can't write image '{args.output}'")
+        else:
+            final_image = decode_milimg(args.input)
 
-        if final_image:
-            final_image.save(args.output)
-            print(f"decode success! image saved as '{args.output}'")
+            if final_image:
+                final_image.save(args.output)
+                print(f"decode success! image saved as '{args.output}'")
 
     except FileNotFoundError:
         print(f"error: file '{args.input}' not found.")
@@ -1,9 +1,29 @@
 import struct
 import argparse
-import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from fractions import Fraction
+from typing import Dict, List, Tuple
 import av
+import numpy as np
 from PIL import Image
 
+# .milimg header: magic, version, width, height, color data size (big-endian)
+_HEADER = struct.Struct(">8sIIIQ")
+# alpha data size, follows the color data block in version 1 files
+_ALPHA_SIZE = struct.Struct(">Q")
+
+# SVT-AV1 refuses frames with a side shorter than this
+SVT_AV1_MIN_SIZE = 4
+
+
+def _alpha_has_transparency(alpha: Image.Image) -> bool:
+    """Check if an extracted alpha band (mode "L") contains valid transparency"""
+    # Check if all alpha channel pixels are 255 (fully opaque)
+    # getextrema() scans the band in C without copying pixels out
+    extrema = alpha.getextrema()
+    return extrema is not None and extrema[0] < 255
+
 
 def has_transparency(img: Image.Image) -> bool:
     """Check if Pillow image object contains valid transparency"""
@@ -11,66 +31,176 @@ def has_transparency(img: Image.Image) -> bool:
         if "transparency" in img.info:
             return True
     elif img.mode == "RGBA":
-        # Check if all alpha channel pixels are 255 (fully opaque)
-        alpha = img.getchannel("A")
-        return any(p < 255 for p in alpha.getdata())
+        return _alpha_has_transparency(img.getchannel("A"))
     return False
 
 
-def encode_to_av1(image: Image.Image, quality: int, is_alpha: bool = False, lossless: bool = True) -> bytes:
+def _encoder_settings(
+    encoder: str, is_alpha: bool, quality: int, lossless: bool, width: int, preset: int
+) -> Tuple[str, Dict[str, str]]:
+    """
+    Build pixel format and encoder options for a channel.
+
+    Returns:
+        (pix_fmt, options) for the codec context.
+    """
+    if encoder == "libaom-av1":
+        # "allintra" disables libaom's video-oriented lookahead and rate control stats,
+        # cpu-used 6 skips most of the exhaustive RD search meant for video
+        options = {"usage": "allintra", "cpu-used": "6", "row-mt": "1"}
+
+        # Split wide frames into tile columns (log2, up to 4 tiles) so encoder threads can work in parallel,
+        # libaom refuses tile layouts the frame is too narrow for, so keep tiles at least 256 pixels wide
+        tile_columns = 0
+        while tile_columns < 2 and width >= 512 << tile_columns:
+            tile_columns += 1
+        options["tile-columns"] = str(tile_columns)
+    else:
+        options = {"preset": str(preset)}
+
+    # --- Apply all precise parameters from reverse engineering ---
+    if is_alpha and encoder == "libaom-av1":
+        pix_fmt = "gray8"  # Alpha channel uses 8-bit grayscale
+    elif is_alpha:
+        # SVT-AV1 has no monochrome input, alpha goes into the full range luma plane of YUV420
+        pix_fmt = "yuv420p"
+        options["color_range"] = "pc"
+    else:
+        pix_fmt = "yuv420p"  # Color channel uses YUV420
+        options["colorspace"] = "bt709"
+        options["color_range"] = "pc"
+
+    # --- Apply user-defined quality parameter ---
+    if encoder == "libaom-av1":
+        if lossless:
+            options["lossless"] = "1"
+            # allintra mode needs an explicit CRF even when lossless
+            options["crf"] = "0"
+        else:
+            options["crf"] = str(quality)
+    elif lossless:
+        options["svtav1-params"] = "lossless=1"
+    else:
+        # SVT-AV1 treats crf 0 as unset, 1 is its highest quality
+        options["crf"] = str(max(quality, 1))
+
+    return pix_fmt, options
+
+
+def _select_encoder(encoder: str, width: int, height: int) -> str:
+    """Fall back to libaom-av1 for images too small for SVT-AV1."""
+    if encoder == "libsvtav1" and min(width, height) < SVT_AV1_MIN_SIZE:
+        return "libaom-av1"
+    return encoder
+
+
+def _alpha_to_yuv420p_frame(alpha: np.ndarray) -> av.VideoFrame:
+    """Build a YUV420 frame with alpha as luma and neutral chroma, for encoders without gray input."""
+    height, width = alpha.shape
+    frame = av.VideoFrame(width, height, "yuv420p")
+    frame.color_range = av.video.reformatter.ColorRange.JPEG
+    # Fill the frame planes in place, rows are padded to line_size
+    for index, plane in enumerate(frame.planes):
+        plane_np = np.frombuffer(plane, dtype=np.uint8).reshape(plane.height, plane.line_size)
+        if index == 0:
+            plane_np[:, :width] = alpha
+        else:
+            plane_np[:] = 128
+    return frame
+
+
+def encode_to_av1(
+    image: Image.Image,
+    quality: int,
+    is_alpha: bool = False,
+    lossless: bool = True,
+    encoder: str = "libsvtav1",
+    preset: int = 8,
+    threads: int = 0,
+) -> bytes:
     """
-    Encode Pillow image to raw AV1 bitstream using PyAV.
+    Encode Pillow image to raw AV1 bitstream (low overhead OBU format) using PyAV.
 
     Args:
         image: Pillow image object.
         quality: AV1 encoding CRF quality value (0-63, lower is higher quality). Ignored if lossless=True.
         is_alpha: If True, encode as grayscale; otherwise encode as color.
         lossless: If True, use lossless encoding mode.
+        encoder: AV1 encoder name, "libsvtav1" or "libaom-av1".
+            libsvtav1 falls back to libaom-av1 for images with a side under 4 pixels.
+        preset: SVT-AV1 speed preset (0-13, higher is faster). Ignored by libaom-av1.
+        threads: Encoder thread count, 0 lets the encoder use all cores.
 
     Returns:
         Encoded raw AV1 bitstream (bytes).
     """
-    output_buffer = io.BytesIO()
-
-    # Use IVF as temporary container to facilitate raw stream extraction
-    with av.open(output_buffer, mode="w", format="ivf") as container:
-        # Use efficient libaom-av1 encoder
-        stream = container.add_stream("libaom-av1", rate=30)
-        stream.width = image.width
-        stream.height = image.height
-
-        # --- Apply all precise parameters from reverse engineering ---
-        if is_alpha:
-            stream.pix_fmt = "gray8"  # Alpha channel uses 8-bit grayscale
-        else:
-            stream.pix_fmt = "yuv420p"  # Color channel uses YUV420
-            stream.options["colorspace"] = "bt709"
-            stream.options["color_range"] = "pc"
+    encoder = _select_encoder(encoder, image.width, image.height)
 
-        # --- Apply user-defined quality parameter ---
-        if lossless:
-            stream.options["lossless"] = "1"
-        else:
-            stream.options["crf"] = str(quality)
+    # Drive the encoder directly, packets are the OBUs stored in .milimg, no container needed
+    ctx = av.codec.CodecContext.create(encoder, "w")
+    ctx.width = image.width
+    ctx.height = image.height
+    ctx.time_base = Fraction(1, 30)
+    ctx.framerate = 30
+    ctx.thread_count = threads
+
+    pix_fmt, options = _encoder_settings(encoder, is_alpha, quality, lossless, image.width, preset)
+    ctx.pix_fmt = pix_fmt
+    ctx.options = options
+    if encoder == "libaom-av1":
+        # Single still frame: intra-only, no keyframe interval or lookahead needed
+        ctx.gop_size = 0
+
+    # np.asarray copies the Pillow pixels once, from_numpy_buffer then wraps that array
+    # as AV Frame without a second copy into a new AVFrame;
+    # alpha stays gray8 so it reaches the encoder without any pixel conversion,
+    # color is converted to yuv420p by the codec context's cached reformatter
+    if is_alpha and pix_fmt == "yuv420p":
+        frame = _alpha_to_yuv420p_frame(np.asarray(image))
+    else:
+        frame = av.VideoFrame.from_numpy_buffer(
+            np.asarray(image), format="gray8" if is_alpha else "rgb24"
+        )
+    frame.pts = 0
 
-        # Convert Pillow image to AV Frame
-        frame = av.VideoFrame.from_image(image)
+    # Encode and flush encoder
+    packets = ctx.encode(frame) + ctx.encode(None)
+    return b"".join(bytes(packet) for packet in packets)
 
-        # Encode
-        for packet in stream.encode(frame):
-            container.mux(packet)
 
-        # Flush encoder
-        for packet in stream.encode():
-            container.mux(packet)
+def _write_parts(path: str, parts: List[bytes]):
+    """
+    Write buffers to a file in order with scatter-gather writes, without concatenating them first.
+    """
+    if not hasattr(os, "writev"):
+        with open(path, "wb") as f:
+            for part in parts:
+                f.write(part)
+        return
 
-    # Strip pure AV1 data from IVF container
-    # IVF header (32 bytes) + frame header (12 bytes) = 44 bytes
-    ivf_data = output_buffer.getvalue()
-    return ivf_data[44:]
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+    try:
+        views = [memoryview(part) for part in parts if len(part)]
+        while views:
+            written = os.writev(fd, views)
+            # writev may write less than requested, drop finished buffers and continue with the rest
+            while views and written >= len(views[0]):
+                written -= len(views[0])
+                views.pop(0)
+            if written:
+                views[0] = views[0][written:]
+    finally:
+        os.close(fd)
 
 
-def encode_milimg(input_path: str, output_path: str, quality: int, lossless: bool = False):
+def encode_milimg(
+    input_path: str,
+    output_path: str,
+    quality: int,
+    lossless: bool = False,
+    encoder: str = "libsvtav1",
+    preset: int = 8,
+):
     """
     Main function: load image, encode, and assemble into .milimg file.
     """
@@ -80,49 +210,73 @@ def encode_milimg(input_path: str, output_path: str, quality: int, lossless: boo
     width, height = img.size
 
     # Check for valid alpha channel to determine version number
-    use_alpha = has_transparency(img)
+    # The alpha channel is extracted once here and reused for encoding below
+    alpha_image = img.getchannel("A")
+    use_alpha = _alpha_has_transparency(alpha_image)
     version = 1 if use_alpha else 0
     print(
         f"image size: {width}x{height}. valid alpha channel detected: {use_alpha}. will generate version {version} file."
     )
 
-    # Encode color channel
-    if lossless:
-        print(f"encoding color channel (YUV420) with lossless mode...")
-    else:
-        print(f"encoding color channel (YUV420) with quality (CRF)={quality}...")
-    rgb_image = img.convert("RGB")
-    color_payload = encode_to_av1(rgb_image, quality, is_alpha=False, lossless=lossless)
-    print(f"color data encoding complete, size: {len(color_payload)} bytes.")
+    selected_encoder = _select_encoder(encoder, width, height)
+    if selected_encoder != encoder:
+        print(f"{encoder} needs at least {SVT_AV1_MIN_SIZE}x{SVT_AV1_MIN_SIZE} pixels, falling back to {selected_encoder}.")
+        encoder = selected_encoder
 
-    alpha_payload = None
-    if version == 1:
+    print(f"using encoder: {encoder}" + (f" (preset {preset})" if encoder == "libsvtav1" else ""))
+    # Encode color and alpha channels concurrently, the AV1 encoders release the GIL while encoding;
+    # with both encodes running side by side (version 1) give each encoder half of the cores
+    threads = max(1, (os.cpu_count() or 1) // 2) if version == 1 else 0
+    with ThreadPoolExecutor(max_workers=2) as pool:
         if lossless:
-            print(f"encoding alpha channel (Grayscale) with lossless mode...")
+            print(f"encoding color channel (YUV420) with lossless mode...")
         else:
-            print(f"encoding alpha channel (Grayscale) with quality (CRF)={quality}...")
-        alpha_image = img.getchannel("A")
-        alpha_payload = encode_to_av1(alpha_image, quality, is_alpha=True, lossless=lossless)
-        print(f"alpha data encoding complete, size: {len(alpha_payload)} bytes.")
+            print(f"encoding color channel (YUV420) with quality (CRF)={quality}...")
+        rgb_image = img.convert("RGB")
+        color_future = pool.submit(
+            encode_to_av1,
+            rgb_image,
+            quality,
+            is_alpha=False,
+            lossless=lossless,
+            encoder=encoder,
+            preset=preset,
+            threads=threads,
+        )
+
+        alpha_future = None
+        if version == 1:
+            if lossless:
+                print(f"encoding alpha channel (Grayscale) with lossless mode...")
+            else:
+                print(f"encoding alpha channel (Grayscale) with quality (CRF)={quality}...")
+            alpha_future = pool.submit(
+                encode_to_av1,
+                alpha_image,
+                quality,
+                is_alpha=True,
+                lossless=lossless,
+                encoder=encoder,
+                preset=preset,
+                threads=threads,
+            )
+
+        color_payload = color_future.result()
+        print(f"color data encoding complete, size: {len(color_payload)} bytes.")
+
+        alpha_payload = None
+        if alpha_future is not None:
+            alpha_payload = alpha_future.result()
+            print(f"alpha data encoding complete, size: {len(alpha_payload)} bytes.")
 
     # Assemble .milimg file
     print("assembling .milimg file...")
-    with open(output_path, "wb") as f:
-        # Write magic number
-        f.write(b"Milimg00")
-        # Write version number (4 bytes, big-endian)
-        f.write(struct.pack(">I", version))
-        # Write metadata (width, height, color data size)
-        f.write(struct.pack(">I", width))
-        f.write(struct.pack(">I", height))
-        f.write(struct.pack(">Q", len(color_payload)))
-        # Write color data block
-        f.write(color_payload)
-
-        if version == 1:
-            # Write alpha metadata and data block
-            f.write(struct.pack(">Q", len(alpha_payload)))
-            f.write(alpha_payload)
+    # Magic number, version, width, height and color data size, followed by the color data block
+    parts = [_HEADER.pack(b"Milimg00", version, width, height, len(color_payload)), color_payload]
+    if version == 1:
+        # Alpha metadata and data block
+        parts += [_ALPHA_SIZE.pack(len(alpha_payload)), alpha_payload]
+    _write_parts(output_path, parts)
 
     print(f"\nsuccess! '{output_path}' created.")
 
@@ -151,13 +305,27 @@ if __name__ == "__main__":
         action="store_true",
         help="use AV1 lossless encoding mode. when enabled, quality parameter is ignored.",
     )
+    parser.add_argument(
+        "-e",
+        "--encoder",
+        choices=["libsvtav1", "libaom-av1"],
+        default="libsvtav1",
+        help="AV1 encoder. libsvtav1 is much faster, but stores alpha as the luma of a 4:2:0 color frame "
+        "instead of monochrome and its lossless output is noticeably larger (about 1.8-2x on small RGBA test images). "
+        "images with a side under 4 pixels always use libaom-av1. default: libsvtav1.",
+    )
+    parser.add_argument(
+        "-p",
+        "--preset",
+        type=int,
+        default=8,
+        help="SVT-AV1 speed preset (0-13). higher value means faster encoding and lower quality. ignored by libaom-av1. default: 8.",
+    )
 
     args = parser.parse_args()
 
     # If output path not specified, generate same name .milimg file in current directory
     if args.output is None:
-        import os
-
         input_basename = os.path.basename(args.input)
         input_name_without_ext = os.path.splitext(input_basename)[0]
         args.output = f"{input_name_without_ext}.milimg"
@@ -165,9 +333,13 @@ if __name__ == "__main__":
 
     if not (0 <= args.quality <= 63):
         print("error: quality value must be between 0 and 63.")
+    elif not (0 <= args.preset <= 13):
+        print("error: preset value must be between 0 and 13.")
     else:
         try:
-            encode_milimg(args.input, args.output, args.quality, args.lossless)
+            # Keep SVT-AV1 from printing its configuration banner for every stream
+            os.environ.setdefault("SVT_LOG", "1")
+            encode_milimg(args.input, args.output, args.quality, args.lossless, args.encoder, args.preset)
         except FileNotFoundError:
             print(f"error: input file '{args.input}' not found.")
         except Exception as e: